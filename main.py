@@ -1,8 +1,16 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import plotly.graph_objects as go
+from curl_cffi import requests as curl_requests
 from datetime import date, timedelta
+from pathlib import Path
+import os
+import time
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # ================= PAGE =================
 st.set_page_config(page_title="Portfolio Tracker", layout="wide")
@@ -10,50 +18,243 @@ st.set_page_config(page_title="Portfolio Tracker", layout="wide")
 # ================= CONSTANTS =================
 BENCHMARK = "NIFTYBEES.NS"
 PERIOD_MAP = {"5D": 5, "1M": 21, "6M": 126, "1Y": 252, "3Y": 756}
+PERIODS = list(PERIOD_MAP)
 MONTHS = ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"]
+DAYS = list(range(1, 32))
+YEARS = list(range(2020, date.today().year+1))
+MAX_WORKERS = 8  # concurrent per-ticker fetches, kept under Yahoo's rate limit
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRIES = 3  # backoff 0.5s, 1s, 2s
+SPARK_URL = "https://query1.finance.yahoo.com/v8/finance/spark"
+CACHE_DIR = Path.home() / ".cache" / "portfolio-tracker"
+COVERED_KEY = b"covered_from"  # parquet metadata: first date a cache file is complete from
 
 # ================= SESSION =================
 if "portfolio" not in st.session_state:
     st.session_state.portfolio = []
+if "earliest" not in st.session_state:
+    # running min of buy dates, updated on add instead of rescanned every rerun
+    try:
+        st.session_state.earliest = min((s["Date"] for s in st.session_state.portfolio), default=None)
+    except KeyError:  # entries saved before buy dates were tracked
+        st.session_state.portfolio = []
+        st.session_state.earliest = None
+if "last_sym" not in st.session_state:
+    st.session_state.last_sym = ""
+    st.session_state.last_cmp = None
 
 # ================= HELPERS =================
-def price(symbol, period="2d"):
-    df = yf.download(symbol, period=period, progress=False)
-    if df.empty:
+class DataUnavailable(Exception):
+    pass
+
+class RetrySession(curl_requests.Session):
+    # curl_cffi has no urllib3-style Retry: retry rate limits, 5xx and transport
+    # errors with exponential backoff so one 429 doesn't become "No data for X"
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(RETRIES + 1):
+            try:
+                r = super().request(method, url, *args, **kwargs)
+            except curl_requests.RequestsError:
+                if attempt == RETRIES:
+                    raise
+            else:
+                if r.status_code not in RETRY_STATUS or attempt == RETRIES:
+                    return r
+            time.sleep(0.5 * 2 ** attempt)
+
+    # the base class binds these to its own request(), so route them through ours
+    def get(self, url, *args, **kwargs):
+        return self.request("GET", url, *args, **kwargs)
+
+    def post(self, url, *args, **kwargs):
+        return self.request("POST", url, *args, **kwargs)
+
+@st.cache_resource
+def http_session():
+    # shared across reruns so Yahoo connections (TCP + TLS) stay alive
+    return RetrySession(impersonate="chrome")
+
+@st.cache_data(ttl=60, max_entries=512, show_spinner=False)
+def price(symbol):
+    # spark quote route: a short JSON close list instead of a full OHLCV DataFrame
+    try:
+        r = http_session().get(SPARK_URL, timeout=5, params={
+            "symbols": symbol, "range": "1d", "interval": "1d", "indicators": "close"})
+        closes = r.json()[symbol]["close"]
+    except (curl_requests.RequestsError, ValueError, KeyError, TypeError):
+        return None
+    if not closes or closes[-1] is None:
         return None
-    return float(df["Close"].iloc[-1])
+    return float(closes[-1])
+
+def download(symbols, start, end):
+    # yfinance fetches each ticker's chart on its own thread (MAX_WORKERS of them);
+    # columns are symbols, values are raw (split-adjusted) Close
+    df = yf.download(symbols, start=start, end=end,
+                     auto_adjust=False, actions=False, repair=False,
+                     threads=MAX_WORKERS, progress=False, session=http_session())["Close"]
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)  # tz-naive to match the cached history
+    return df.reindex(columns=symbols)
 
-def series(symbol, start, end):
-    df = yf.download(symbol, start=start, end=end, progress=False)
-    if df.empty:
+def cache_path(symbol):
+    return CACHE_DIR / f"{symbol}.parquet"
+
+def load_cached(symbol):
+    # (Close series, date it is complete from), or None if absent or unreadable
+    try:
+        table = pq.read_table(cache_path(symbol))
+        covered = pd.Timestamp(table.schema.metadata[COVERED_KEY].decode())
+    except (OSError, ValueError, KeyError, TypeError):
         return None
-    return df["Close"]
+    return table.to_pandas()["Close"].astype(np.float64), covered
+
+def save_cached(symbol, close, covered):
+    table = pa.Table.from_pandas(close.astype(np.float32).to_frame("Close"))
+    table = table.replace_schema_metadata({**table.schema.metadata, COVERED_KEY: covered.isoformat().encode()})
+    # write beside the target and swap it in: every session shares CACHE_DIR,
+    # so a reader must never see a half-written file
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, cache_path(symbol))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def drop_cached(symbols):
+    # Yahoo rewrites past closes after splits; a tail fetch alone would keep the stale history
+    for sym in symbols:
+        cache_path(sym).unlink(missing_ok=True)
+
+@st.cache_data(ttl=900, max_entries=512, show_spinner=False)
+def history(symbols, start, end):
+    # the disk cache keeps every Close seen so far; only the missing span is downloaded
+    cached = {sym: load_cached(sym) for sym in symbols}
+    # compare against the stored bound, not the first cached row: start may be a
+    # holiday or predate the listing, and neither means the cache is incomplete
+    full = [sym for sym in symbols if cached[sym] is None or cached[sym][1] > start]
+    tail = [sym for sym in symbols if sym not in full]
+
+    frames = []
+    if tail:
+        # overlap the cache by its last settled day, so the final (possibly partial
+        # intraday) close is replaced and there is a settled close to re-check
+        check = {sym: cached[sym][0].index[-2 if len(cached[sym][0]) > 1 else -1] for sym in tail}
+        since = min(check.values())
+        if since < end:
+            recent = download(tail, since, end)
+            # Yahoo rewrites past closes after a split or bonus; a changed overlap
+            # means the cached history is stale, so fetch that symbol in full
+            stale = []
+            for sym in tail:
+                old, new = cached[sym][0][check[sym]], recent[sym].get(check[sym], np.nan)
+                if not np.isnan(new) and not np.isclose(new, old, rtol=1e-5):  # float32 rounding is ~1e-7
+                    cached[sym] = None
+                    stale.append(sym)
+            full += stale
+            frames.append(recent.drop(columns=stale))
+    if full:
+        frames.append(download(full, start, end))
+    fetched = pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    out = {}
+    for sym in symbols:
+        close, covered = cached[sym] or (None, start)
+        if sym in fetched:
+            new = fetched[sym].dropna()
+            close = new if close is None else new.combine_first(close)
+            if not new.empty:
+                # stored as float32: ~1e-7 relative rounding (about ₹0.02 at MRF's ₹1.3 lakh),
+                # far below the whole-rupee values the UI shows
+                save_cached(sym, close, start if sym in full else covered)
+        if close is None:
+            close = pd.Series(dtype=np.float64, index=pd.DatetimeIndex([]))
+        out[sym] = close[(close.index >= start) & (close.index < end)]
+    return pd.DataFrame(out).reindex(columns=symbols)
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def compute(holdings, start, end):
+    # keyed on (symbol, qty, buy) tuples: reruns that leave the portfolio and
+    # timeframe alone skip the download, alignment and product entirely
+    syms, qtys, buys = zip(*holdings)
+    qtys = np.asarray(qtys, dtype=np.float64)
+    invested = float(qtys @ np.asarray(buys, dtype=np.float64))
+
+    symbols = list(dict.fromkeys([*syms, BENCHMARK]))
+    closes = history(symbols, start, end)
+
+    prices = closes[list(syms)]
+    nifty = closes[BENCHMARK]
+    if nifty.isna().all():
+        raise DataUnavailable("NIFTY data unavailable")
+
+    # every column shares the download's calendar, so aligning is a row mask
+    traded = (nifty.notna() & prices.notna().any(axis=1)).to_numpy()
+    prices = prices[traded]
+
+    # dates x holdings price matrix times quantity vector -> portfolio value per date
+    portfolio_value = pd.Series(prices.fillna(0).to_numpy() @ qtys, index=prices.index)
+    return portfolio_value, nifty[traded], prices, invested
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def chart(dates, port_ret, nifty_ret, period):
+    # cache_resource hands back the same figure object; cache_data would unpickle
+    # a copy, and plotly re-validates every trace when it rebuilds one
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=dates, y=port_ret,
+        name="Portfolio %",
+        line=dict(width=3)
+    ))
+    fig.add_trace(go.Scatter(
+        x=dates, y=nifty_ret,
+        name="NIFTY %",
+        line=dict(dash="dash")
+    ))
+    fig.update_layout(
+        template="plotly_dark",
+        hovermode="x unified",
+        height=450,
+        yaxis_title="% Return",
+        uirevision=period  # keep zoom/legend across reruns, reset on a new timeframe
+    )
+    return fig
 
 # ================= HEADER =================
 st.title("📈 Portfolio Tracker")
 
 # ================= ADD STOCK =================
 with st.expander("➕ Add Stock", expanded=len(st.session_state.portfolio)==0):
-    stock = st.text_input("Stock symbol (example: INFY.NS)")
+    # yf.download upper-cases tickers in its result columns, so store them that way
+    stock = st.text_input("Stock symbol (example: INFY.NS)").strip().upper()
     qty = st.number_input("Quantity", min_value=1, step=1)
-    cmp = price(stock) if stock else 0.0
+    # quote only when the symbol changes, not on every widget rerun; a failed quote
+    # is retried (price() caches it for 60s) rather than kept until the symbol changes
+    if stock != st.session_state.last_sym or st.session_state.last_cmp is None:
+        st.session_state.last_cmp = price(stock) if stock else None
+        st.session_state.last_sym = stock
+    cmp = st.session_state.last_cmp
     buy = st.number_input("Buy Price (₹)", value=round(cmp,2) if cmp else 0.0)
 
     d1, d2, d3 = st.columns(3)
     today = date.today()
-    with d1: day = st.selectbox("Day", list(range(1,32)), index=today.day-1)
+    with d1: day = st.selectbox("Day", DAYS, index=today.day-1)
     with d2: month = st.selectbox("Month", MONTHS, index=today.month-1)
-    with d3: year = st.selectbox("Year", list(range(2020,today.year+1)),
-                                  index=len(range(2020,today.year+1))-1)
+    with d3: year = st.selectbox("Year", YEARS, index=len(YEARS)-1)
 
     if st.button("Add to Portfolio"):
         if stock and buy>0:
+            buy_date = date(year, MONTHS.index(month)+1, day)
             st.session_state.portfolio.append({
                 "Symbol": stock,
                 "Qty": qty,
                 "Buy": buy,
-                "Date": date(year, MONTHS.index(month)+1, day)
+                "Date": buy_date
             })
+            st.session_state.earliest = min(st.session_state.earliest or buy_date, buy_date)
             st.rerun()
 
 # ================= PORTFOLIO =================
@@ -61,72 +262,51 @@ if not st.session_state.portfolio:
     st.info("Add at least one stock to see portfolio analytics.")
     st.stop()
 
-period = st.radio("Timeframe", list(PERIOD_MAP.keys()), horizontal=True)
+p1, p2 = st.columns([5, 1])
+with p1: period = st.radio("Timeframe", PERIODS, horizontal=True)
+with p2:
+    if st.button("🔄 Refresh"):
+        drop_cached({s["Symbol"] for s in st.session_state.portfolio} | {BENCHMARK})
+        st.session_state.last_sym = ""
+        compute.clear()
+        history.clear()
+        price.clear()
 
 # ================= ENGINE =================
 today = date.today()
-
-# ✅ ONLY FIX — NOTHING ELSE CHANGED
-try:
-    earliest = min(s["Date"] for s in st.session_state.portfolio)
-except KeyError:
-    st.session_state.portfolio = []
-    st.experimental_rerun()
-
-start = pd.Timestamp(max(earliest, today - timedelta(days=PERIOD_MAP[period]*2)))
+span = pd.Timestamp(max(st.session_state.earliest, today - timedelta(days=max(PERIOD_MAP.values())*2)))
+start = pd.Timestamp(max(st.session_state.earliest, today - timedelta(days=PERIOD_MAP[period]*2)))
 end = pd.Timestamp(today)
 
-portfolio_lines = []
-invested = 0
-
-for s in st.session_state.portfolio:
-    srs = series(s["Symbol"], start, end)
-    if srs is None:
-        st.error(f"No data for {s['Symbol']}")
-        st.stop()
-    srs = srs.dropna()
-    portfolio_lines.append(srs * s["Qty"])
-    invested += s["Qty"] * s["Buy"]
-
-portfolio_value = pd.concat(portfolio_lines, axis=1).sum(axis=1)
-
-# ================= NIFTY =================
-nifty = series(BENCHMARK, start, end)
-if nifty is None:
-    st.error("NIFTY data unavailable")
+# always compute the widest timeframe so switching timeframes is a cache hit plus a slice
+holdings = tuple((s["Symbol"], s["Qty"], s["Buy"]) for s in st.session_state.portfolio)
+try:
+    portfolio_value, nifty, prices, invested = compute(holdings, span, end)
+except DataUnavailable as e:
+    st.error(str(e))
     st.stop()
+portfolio_value, nifty, prices = portfolio_value[start:], nifty[start:], prices[start:]
 
-common_dates = portfolio_value.index.intersection(nifty.index)
-portfolio_value = portfolio_value.loc[common_dates]
-nifty = nifty.loc[common_dates]
+# checked on the selected window: a holding priced only earlier in the span would
+# otherwise count as 0 here
+missing = prices.columns[prices.isna().all().to_numpy()]
+if len(missing):
+    st.error(f"No data for {missing[0]}")
+    st.stop()
 
 # ================= RETURNS =================
-port_ret = (portfolio_value / portfolio_value.iloc[0] - 1) * 100
-nifty_ret = (nifty / nifty.iloc[0] - 1) * 100
+# on the raw arrays: one scale-and-shift per series, no index alignment
+dates = portfolio_value.index.to_numpy()
+pv, nv = portfolio_value.to_numpy(), nifty.to_numpy()
+port_ret = pv * (100.0 / pv[0]) - 100.0
+nifty_ret = nv * (100.0 / nv[0]) - 100.0
 
 # ================= KPIs =================
 c1,c2,c3,c4 = st.columns(4)
-c1.metric("Value", f"₹{portfolio_value.iloc[-1]:,.0f}")
-c2.metric("Total P/L", f"₹{portfolio_value.iloc[-1]-invested:,.0f}")
-c3.metric("Portfolio %", f"{port_ret.iloc[-1]:.2f}%")
-c4.metric("NIFTY %", f"{nifty_ret.iloc[-1]:.2f}%")
+c1.metric("Value", f"₹{pv[-1]:,.0f}")
+c2.metric("Total P/L", f"₹{pv[-1]-invested:,.0f}")
+c3.metric("Portfolio %", f"{port_ret[-1]:.2f}%")
+c4.metric("NIFTY %", f"{nifty_ret[-1]:.2f}%")
 
 # ================= CHART =================
-fig = go.Figure()
-fig.add_trace(go.Scatter(
-    x=port_ret.index, y=port_ret,
-    name="Portfolio %",
-    line=dict(width=3)
-))
-fig.add_trace(go.Scatter(
-    x=nifty_ret.index, y=nifty_ret,
-    name="NIFTY %",
-    line=dict(dash="dash")
-))
-fig.update_layout(
-    template="plotly_dark",
-    hovermode="x unified",
-    height=450,
-    yaxis_title="% Return"
-)
-st.plotly_chart(fig, use_container_width=True)
+st.plotly_chart(chart(dates, port_ret, nifty_ret, period), use_container_width=True)